@@ -1,27 +1,39 @@
 import re
+import sys
+from array import array
 from itertools import count
 from .cpu import Instructions, InstructionArgTypes, instruction_methods
 from ._types import NativeNumber, Address
 from typing import Generator, List, Union
-import itertools
 
-LowercaseInstructions = {instruction.name.lower(): instruction for instruction in Instructions}
+# lowercase name -> (Instructions member, arg type), resolved once at import so
+# instruction lines pay a single dict lookup instead of enum access plus
+# instruction_methods access
+_INSTR_INFO = {instruction.name.lower(): (instruction, instruction_methods[instruction][1])
+               for instruction in Instructions}
 
-chain = itertools.chain.from_iterable
+_ZERO = NativeNumber(0)
 
 HEX_NUMBER_PATTERN = r'[\-\+]?(?:0x[0-9a-fA-F]+)'
 DEC_NUMBER_PATTERN = r'[\-\+]?(?:\d+)'
 NUMBER_PATTERN = rf'(?:{DEC_NUMBER_PATTERN}|{HEX_NUMBER_PATTERN})'
 ADDRESS_LITERAL_PATTERN = NUMBER_PATTERN
 IDENTIFIER_FIRST_CHARACTER_PATTERN = r'[a-zA-Z_]'
-IDENTIFIER_CHARACTER_PATTERN = r'[a-zA-Z_0-9]'
+IDENTIFIER_CHARACTER_PATTERN = r'\w'  # ASCII-only, all patterns compile with re.ASCII
 SPACER_CHARACTER_PATTERN = r'[ \t]'
 LABEL_PATTERN = rf'{IDENTIFIER_FIRST_CHARACTER_PATTERN}{IDENTIFIER_CHARACTER_PATTERN}*:'
 LABEL_VALUE_PATTERN = rf':{IDENTIFIER_FIRST_CHARACTER_PATTERN}{IDENTIFIER_CHARACTER_PATTERN}*'
 ADDRESS_PATTERN = rf'(?:{ADDRESS_LITERAL_PATTERN}|{LABEL_VALUE_PATTERN})'
 INDENTATION_PATTERN = rf'^{SPACER_CHARACTER_PATTERN}*'
 LINE_END_PATTERN = rf'{SPACER_CHARACTER_PATTERN}*(?:#.*)?$'
-INSTRUCTION_NAME_PATTERN = '|'.join(map(lambda i: f'(?i:{i.name})', Instructions))
+# one case-insensitive group around a flat alternation; names sorted longest
+# first so a mnemonic that prefixes another (St/Stk) matches without backtracking
+INSTRUCTION_NAME_PATTERN = '(?i:' + '|'.join(
+    sorted((instruction.name for instruction in Instructions), key=len, reverse=True)) + ')'
+
+LABEL_FULL_PATTERN = re.compile(rf'^{LABEL_PATTERN}$', re.ASCII)
+LABEL_VALUE_FULL_PATTERN = re.compile(rf'^{LABEL_VALUE_PATTERN}$', re.ASCII)
+LABEL_VALUE_COMPILED_PATTERN = re.compile(LABEL_VALUE_PATTERN, re.ASCII)
 
 
 class CompilationError(Exception):
@@ -48,29 +60,49 @@ def int_to_address(value):
 
 
 class Label(str):
+    __slots__ = ()
+
     @staticmethod
     def __new__(cls, string_value):
-        if re.match(rf'^{LABEL_PATTERN}$', string_value) is None:
+        if LABEL_FULL_PATTERN.match(string_value) is None:
             raise CompilationError(f'Invalid label')
         # noinspection PyArgumentList
-        return str.__new__(cls, string_value[:-1])
+        return str.__new__(cls, sys.intern(string_value[:-1]))
+
+    @classmethod
+    def _trusted(cls, identifier):
+        # identifier already matched by a line-level pattern, colon stripped
+        return str.__new__(cls, sys.intern(identifier))
 
 
 class LabelValue(str):
+    __slots__ = ()
+
     @staticmethod
     def __new__(cls, string_value):
-        if re.match(rf'^{LABEL_VALUE_PATTERN}$', string_value) is None:
+        if LABEL_VALUE_FULL_PATTERN.match(string_value) is None:
             raise CompilationError(f'Invalid label value')
         # noinspection PyArgumentList
-        return str.__new__(cls, string_value[1:])
+        return str.__new__(cls, sys.intern(string_value[1:]))
+
+    @classmethod
+    def _trusted(cls, identifier):
+        # identifier already matched by a line-level pattern, colon stripped
+        return str.__new__(cls, sys.intern(identifier))
+
+
+def _parse_int_literal(address_str: str) -> int:
+    # '0x' after an optional sign means hex, anything else is decimal;
+    # int() itself rejects malformed literals
+    base = 16 if '0x' in address_str[:3] else 10
+    try:
+        return int(address_str, base)
+    except ValueError:
+        raise CompilationError(f'Invalid address value {address_str}')
 
 
 def parse_address_literal(address_str: str) -> Address:
-    if re.match(HEX_NUMBER_PATTERN, address_str):
-        return int_to_address(int(address_str, 16))
-    if re.match(NUMBER_PATTERN, address_str):
-        return int_to_address(int(address_str))
-    raise CompilationError(f'Invalid address value {address_str}')
+    return int_to_address(_parse_int_literal(address_str))
 
 
 def parse_address(address_str: str, labels: dict = None) -> Union[Address, LabelValue]:
@@ -78,9 +110,9 @@ def parse_address(address_str: str, labels: dict = None) -> Union[Address, Label
         return parse_address_literal(address_str)
     except CompilationError:
         pass
-    if re.match(LABEL_VALUE_PATTERN, address_str):
+    if LABEL_VALUE_COMPILED_PATTERN.match(address_str):
         if labels is None:
-            return LabelValue(address_str)
+            return LabelValue._trusted(address_str[1:])
         try:
             return labels[address_str]
         except KeyError:
@@ -88,120 +120,233 @@ def parse_address(address_str: str, labels: dict = None) -> Union[Address, Label
     raise CompilationError(f'Invalid address value {address_str}')
 
 
+def _fast_parse_address(address_str: str) -> Union[Address, LabelValue]:
+    # for strings already matched by ADDRESS_PATTERN: a leading ':' means
+    # label reference, anything else is a numeric literal
+    if address_str[0] == ':':
+        return LabelValue._trusted(address_str[1:])
+    return parse_address_literal(address_str)
+
+
 class Line:
-    def __init__(self, address: Address, *args):
+    __slots__ = ('address', '_pad_n')
+
+    def __init__(self, address: Address):
         self.address = address
+        self._pad_n = 0
 
     def produced_bytes_padded_num(self) -> int:
-        return 0
+        return self._pad_n
 
     def produced_bytes(self) -> List[Union[Instructions, NativeNumber, Address]]:
         return []
 
-    def produce_bytes_padded(self) -> List[Union[Instructions, NativeNumber, Address]]:
+    def produce_bytes_padded(self) -> Generator[Union[Instructions, NativeNumber, Address], None, None]:
         produced = self.produced_bytes()
-        produced_len = len(produced)
-        produced_bytes_padded_num = self.produced_bytes_padded_num()
-        if produced_len > produced_bytes_padded_num:
-            raise RuntimeError(f'{self.__class__}.produced_bytes returned too many bytes')
-        return produced + [NativeNumber(0)] * (produced_bytes_padded_num - produced_len)
+        padding = self._pad_n - len(produced)
+        assert padding >= 0, f'{self.__class__}.produced_bytes returned too many bytes'
+        yield from produced
+        for _ in range(padding):
+            yield _ZERO
 
 
 class EmptyLine(Line):
+    __slots__ = ()
+
     Pattern = rf'{INDENTATION_PATTERN}{LINE_END_PATTERN}'
+    CompiledPattern = re.compile(Pattern, re.ASCII)
 
 
 class OffsetLine(Line):
+    __slots__ = ('offset',)
+
     Pattern = rf'{INDENTATION_PATTERN}(?i:offset){SPACER_CHARACTER_PATTERN}+({ADDRESS_LITERAL_PATTERN}){LINE_END_PATTERN}'
+    CompiledPattern = re.compile(Pattern, re.ASCII)
 
     def __init__(self, address, offset_str):
         super().__init__(address)
-        self.offset = parse_address_literal(offset_str)
-        if self.offset.value < address.value:
-            raise CompilationError(f'Inavalid offset {self.offset.value} at {address.value}')
-
-    def produced_bytes_padded_num(self) -> int:
-        return self.offset.value - self.address.value
+        offset = _parse_int_literal(offset_str)
+        if offset < address.value:
+            raise CompilationError(f'Inavalid offset {offset} at {address.value}')
+        self.offset = int_to_address(offset)
+        self._pad_n = offset - address.value
 
 
 class LabelLine(Line):
+    __slots__ = ('label',)
+
     Pattern = rf'{INDENTATION_PATTERN}({LABEL_PATTERN}){LINE_END_PATTERN}'
+    CompiledPattern = re.compile(Pattern, re.ASCII)
 
     def __init__(self, address: Address, identifier: str):
         super().__init__(address)
-        self.label = Label(identifier)
+        self.label = Label._trusted(identifier[:-1])
 
 
 class ValueLine(Line):
+    __slots__ = ('value',)
+
     Pattern = rf'{INDENTATION_PATTERN}({ADDRESS_PATTERN}){LINE_END_PATTERN}'
+    CompiledPattern = re.compile(Pattern, re.ASCII)
 
     def __init__(self, address: Address, value: str):
         super().__init__(address)
-        self.value = parse_address(value)
-
-    def produced_bytes_padded_num(self):
-        return 1
+        self.value = _fast_parse_address(value)
+        self._pad_n = 1
 
     def produced_bytes(self) -> List[Union[Instructions, NativeNumber, Address]]:
         return [self.value]
 
 
 class InstructionLine(Line):
+    __slots__ = ('instruction', 'args')
+
     Pattern = rf'{INDENTATION_PATTERN}({INSTRUCTION_NAME_PATTERN})((?:{SPACER_CHARACTER_PATTERN}+{ADDRESS_PATTERN})*){LINE_END_PATTERN}'
+    CompiledPattern = re.compile(Pattern, re.ASCII)
 
     def __init__(self, address: Address, instruction_name: str, args_str: str):
-        super().__init__(address, instruction_name, args_str)
-        args = args_str.strip().split(' ') if args_str else []
-        try:
-            instruction = LowercaseInstructions[instruction_name.lower()]
-        except KeyError:
+        super().__init__(address)
+        args = args_str.split() if args_str else ()
+        info = _INSTR_INFO.get(instruction_name.lower())
+        if info is None:
             raise CompilationError(f'Invalid instruction {instruction_name}')
-        _, arg_type = instruction_methods[instruction]
+        instruction, arg_type = info
         if arg_type == InstructionArgTypes.NoArg and args:
             raise CompilationError(f'Instruction {instruction_name} takes no arguments, {len(args)} given')
         if arg_type != InstructionArgTypes.NoArg and not args:
             raise CompilationError(f'Instruction {instruction_name} takes 1 arguments, none given')
         self.instruction = instruction
-        self.args = tuple(map(parse_address, args))
-
-    def produced_bytes_padded_num(self):
-        return 1 + len(self.args)
+        self.args = tuple(_fast_parse_address(arg) for arg in args)
+        self._pad_n = 1 + len(self.args)
 
     def produced_bytes(self) -> List[Union[Instructions, NativeNumber, Address, Label]]:
         return [self.instruction, *self.args]
 
 
+# All line classes combined into one alternation, tried in the same order as the
+# old sequential dispatch. A single match of _MASTER_PATTERN replaces up to five
+# per-line re.match calls; match.lastgroup names the class that matched.
+_LINE_CLASSES = (('empty', EmptyLine),
+                 ('offset', OffsetLine),
+                 ('value', ValueLine),
+                 ('instruction', InstructionLine),
+                 ('label', LabelLine))
+_MASTER_PATTERN = re.compile('^(?:' + '|'.join(
+    f'(?P<{tag}>{cls.Pattern[1:]})' for tag, cls in _LINE_CLASSES) + ')', re.ASCII)
+
+# lastgroup -> (class, slice of match.groups() holding the constructor args)
+_MASTER_DISPATCH = {}
+_group_index = 1
+for _tag, _cls in _LINE_CLASSES:
+    _sub_groups = _cls.CompiledPattern.groups
+    _MASTER_DISPATCH[_tag] = (_cls, _group_index, _group_index + _sub_groups)
+    _group_index += 1 + _sub_groups
+del _tag, _cls, _sub_groups, _group_index
+
+# The tokenizer below recognizes the same grammar as _MASTER_PATTERN without
+# invoking the regex engine. Set _FAST = False to fall back to the regex
+# dispatcher for cross-validation.
+_FAST = True
+# _FAST = False
+
+_HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+
+
+def _is_identifier(token: str) -> bool:
+    # Python identifier rules match the label grammar once non-ASCII is excluded
+    return token.isascii() and token.isidentifier()
+
+
+def _is_number(token: str) -> bool:
+    body = token[1:] if token and token[0] in '+-' else token
+    if body[:2] == '0x':
+        body = body[2:]
+        return body != '' and all(c in _HEX_DIGITS for c in body)
+    return body != '' and body.isascii() and body.isdigit()
+
+
+def _is_address(token: str) -> bool:
+    if token[0] == ':':
+        return _is_identifier(token[1:])
+    return _is_number(token)
+
+
+def _tokenize_line(line: str):
+    comment = line.find('#')
+    if comment >= 0:
+        line = line[:comment]
+    tokens = line.split()
+    if not tokens:
+        return EmptyLine, ()
+    first = tokens[0]
+    if first[-1] == ':':
+        if len(tokens) == 1 and _is_identifier(first[:-1]):
+            return LabelLine, (first,)
+        raise CompilationError('Invalid syntax')
+    if len(tokens) == 1 and _is_address(first):
+        return ValueLine, (first,)
+    lowered = first.lower()
+    if lowered == 'offset':
+        if len(tokens) == 2 and _is_number(tokens[1]):
+            return OffsetLine, (tokens[1],)
+        raise CompilationError('Invalid syntax')
+    if lowered in _INSTR_INFO:
+        for token in tokens[1:]:
+            if not _is_address(token):
+                raise CompilationError('Invalid syntax')
+        return InstructionLine, (first, ' '.join(tokens[1:]))
+    raise CompilationError('Invalid syntax')
+
+
 def parse(lines) -> Generator[Line, None, None]:
     if isinstance(lines, str):
         lines = lines.split('\n')
-    classes = [EmptyLine, OffsetLine, ValueLine, InstructionLine, LabelLine]
     line_address = 0
     for line_number, line in zip(count(1), lines):
         try:
-            try:
-                cls, match = next(filter(lambda p: p[1], map(lambda c: (c, re.match(c.Pattern, line)), classes)))
-            except StopIteration:
-                raise CompilationError('Invalid syntax')
-            line = cls(Address(line_address), *match.groups())
-            line_address += line.produced_bytes_padded_num()
+            if _FAST:
+                cls, groups = _tokenize_line(line)
+            else:
+                match = _MASTER_PATTERN.match(line)
+                if match is None:
+                    raise CompilationError('Invalid syntax')
+                cls, groups_begin, groups_end = _MASTER_DISPATCH[match.lastgroup]
+                groups = match.groups()[groups_begin:groups_end]
+            line = cls(Address(line_address), *groups)
+            line_address += line._pad_n
             yield line
         except CompilationError as error:
             error.message = f'Line {line_number}: {line}\n    {error.message}'
             raise error
 
 
-def compile(lines):
+def compile_to_list(lines) -> List[Union[Instructions, NativeNumber, Address]]:
     parsed = list(parse(lines))
 
     # first pass to determine addresses of labels
-    labels = {line.label: line.address for line in [line for line in parsed if isinstance(line, LabelLine)]}
-
-    def resolve(line_number, byte):
+    labels = {line.label: line.address for line in parsed if type(line) is LabelLine}
+
+    # second pass writes into a pre-sized buffer; label references are
+    # recorded as fix-ups and patched afterwards
+    out = [None] * sum(line._pad_n for line in parsed)
+    fixups = []
+    index = 0
+    for line_number, line in enumerate(parsed):
+        for byte in line.produce_bytes_padded():
+            if byte.__class__ is LabelValue:
+                fixups.append((index, line_number))
+            out[index] = byte
+            index += 1
+    for index, line_number in fixups:
+        label = out[index]
         try:
-            return labels[byte] if isinstance(byte, LabelValue) else byte
+            out[index] = labels[label]
         except KeyError:
-            raise CompilationError(f'Line {line_number}: Invalid label {byte}')
+            raise CompilationError(f'Line {line_number}: Invalid label {label}')
+    return out
+
 
-    # second pass to produce bytecode
-    return list(chain([[resolve(line_number, byte) for byte in line.produce_bytes_padded()]
-                       for line_number, line in zip(count(0), parsed)]))
+def compile(lines) -> array:
+    # machine words as unsigned 16 bit, the representation RAM stores anyway;
+    # compile_to_list keeps the symbolic stream for callers that inspect it
+    return array('H', (byte.value & 0xffff for byte in compile_to_list(lines)))